@@ -1,10 +1,51 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
+from typing import Optional
 
+import msgspec
+import orjson
 import psycopg2
-from db_setup import get_connection
-from fastapi import FastAPI, HTTPException
+from cache import close_cache, get_presentation, invalidate_presentation
+from db import (options_bulk_create, presentations_delete, presentations_get, presentations_list, presentations_update,
+                qna_messages_stream_for_session, question_types_list, users_list,
+                votes_bulk_create, votes_copy, votes_stream_for_session)
+from db_setup import close_async_pool, close_pool, get_db, init_pool, pooled_connection
+from fastapi import Body, Depends, FastAPI, HTTPException, Path, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from live import close_listener, subscribe_votes, unsubscribe_votes
+from psycopg2.errors import (ConnectionException, ForeignKeyViolation, InsufficientResources, OperatorIntervention,
+                             TransactionRollback)
+from psycopg2.pool import PoolError
+from schemas import OptionCreate, PresentationUpdate, VoteCreate
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_pool()
+    global vote_writer_task
+    vote_writer_task = asyncio.create_task(vote_writer())
+    yield
+    # Let vote_writer write everything queued, including the batch it is working on, before the pool goes away
+    try:
+        await asyncio.wait_for(vote_queue.join(), VOTE_SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(" Error, votes not written at shutdown, still queued:", vote_queue.qsize())
+    vote_writer_task.cancel()
+    close_pool()
+    await close_async_pool()
+    await close_cache()
+    await close_listener()
+
+
+# Endpoints declare what they return, so fastapi (pydantic) writes the JSON bytes directly
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(PoolError)
+async def no_free_connection(request: Request, exc: PoolError):
+    # Every connection has been busy for POOL_TIMEOUT seconds, ask the client to come back
+    return JSONResponse(status_code=503, content={"detail": "Server busy, try again"})
 
 """
 ADD ENDPOINTS FOR FASTAPI HERE
@@ -21,18 +62,257 @@ but will have different HTTP-verbs.
 
 # INSPIRATION FOR A LIST-ENDPOINT - Not necessary to use pydantic models, but we could to ascertain that we return the correct values
 # @app.get("/items/")
-# def read_items():
-#     con = get_connection()
+# def read_items(con=Depends(get_db, scope="function")):
 #     items = get_items(con)
 #     return {"items": items}
 
 
 # INSPIRATION FOR A POST-ENDPOINT, uses a pydantic model to validate
 # @app.post("/validation_items/")
-# def create_item_validation(item: ItemCreate):
-#     con = get_connection()
+# def create_item_validation(item: ItemCreate, con=Depends(get_db, scope="function")):
 #     item_id = add_item_validation(con, item)
 #     return {"item_id": item_id}
 
 
-# IMPLEMENT THE ACTUAL ENDPOINTS! Feel free to remove
\ No newline at end of file
+# IMPLEMENT THE ACTUAL ENDPOINTS! Feel free to remove
+
+
+@app.get("/users")
+def read_users(limit: int = Query(200, ge=1, le=1000), after_id: int = Query(0, ge=0, le=2**31 - 1),
+               con=Depends(get_db, scope="function")) -> dict:
+    return {"users": users_list(con, limit, after_id)}
+
+
+@app.get("/presentations")
+def read_presentations(limit: int = Query(200, ge=1, le=1000),
+                       before_id: Optional[int] = Query(None, ge=1, le=2**31 - 1),
+                       con=Depends(get_db, scope="function")):
+    # Already JSON, so skip fastapi's encoding of the rows
+    return Response(content=presentations_list(con, limit, before_id), media_type="application/json")
+
+
+@app.get("/presentations/{presentation_id}")
+async def read_presentation(presentation_id: int = Path(ge=1, le=2**31 - 1)) -> dict:
+    presentation = await get_presentation(presentation_id)
+    if presentation is None:
+        raise HTTPException(status_code=404, detail="Presentation not found")
+    return presentation
+
+
+def update_presentation_title(con, presentation_id: int, title: str):
+    presentation = presentations_get(con, presentation_id)
+    if presentation is None:
+        return None
+    return presentations_update(con, presentation_id, presentation["owner_id"], title)
+
+
+# Both commit before dropping the cached copy, otherwise a read in between could cache the old row again
+@app.put("/presentations/{presentation_id}")
+async def update_presentation(presentation: PresentationUpdate,
+                              presentation_id: int = Path(ge=1, le=2**31 - 1)) -> dict:
+    async with pooled_connection() as con:
+        updated = await run_in_threadpool(update_presentation_title, con, presentation_id, presentation.title)
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Presentation not found")
+    await invalidate_presentation(presentation_id)
+    return updated
+
+
+@app.delete("/presentations/{presentation_id}", status_code=204)
+async def delete_presentation(presentation_id: int = Path(ge=1, le=2**31 - 1)) -> None:
+    async with pooled_connection() as con:
+        deleted = await run_in_threadpool(presentations_delete, con, presentation_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Presentation not found")
+    await invalidate_presentation(presentation_id)
+
+
+@app.get("/question-types")
+def read_question_types(con=Depends(get_db, scope="function")) -> dict:
+    # Kept in memory by db.py, con is only used when that copy is too old
+    return {"question_types": question_types_list(con)}
+
+
+# All options go in one INSERT, so cap how many a client can send at once
+OPTIONS_BULK_MAX = 100
+
+
+@app.post("/questions/{question_id}/options/bulk", status_code=201)
+def add_options_bulk(question_id: int = Path(ge=1, le=2**31 - 1),
+                     options: list[OptionCreate] = Body(max_length=OPTIONS_BULK_MAX),
+                     con=Depends(get_db, scope="function")) -> dict:
+    rows = [(option.text, option.is_correct, option.order_index) for option in options]
+    try:
+        created = options_bulk_create(con, question_id, rows)
+    except ForeignKeyViolation:
+        raise HTTPException(status_code=404, detail="Question not found")
+    return {"options": created}
+
+
+async def ndjson_stream(stream, *args):
+    # Uses its own connection, held until the last row is sent. get_db's connection is committed
+    # and given back when the endpoint returns, before the body is sent.
+    # Each row is fetched in the threadpool, the stream blocks on psycopg2
+    async with pooled_connection() as con:
+        async for row in iterate_in_threadpool(stream(con, *args)):
+            yield orjson.dumps(row) + b"\n"
+
+
+# Buffered votes: the endpoint only queues the vote, vote_writer writes them in
+# batches with COPY every VOTE_FLUSH_INTERVAL seconds or VOTE_FLUSH_ROWS votes
+VOTE_FLUSH_INTERVAL = 0.05
+VOTE_FLUSH_ROWS = 1000
+# When this many votes wait to be written the endpoint answers 503 instead of queueing more
+VOTE_QUEUE_MAX = 20_000
+VOTE_RETRY_MAX_DELAY = 5  # seconds
+VOTE_SHUTDOWN_TIMEOUT = 10
+vote_queue = asyncio.Queue(maxsize=VOTE_QUEUE_MAX)
+vote_writer_task = None
+
+# After this many failed attempts a batch is written vote by vote, so one vote that keeps failing
+# can't hold back the others
+VOTE_RETRY_ATTEMPTS = 3
+
+# Errors that say nothing about the votes (database down or restarting, no free connection),
+# the batch is tried again. Any other error is blamed on the votes: a repeated or invalid vote,
+# an id too big for COPY, a value over some limit of Postgres...
+TRANSIENT_ERRORS = (PoolError, psycopg2.InterfaceError, ConnectionException, OperatorIntervention,
+                    InsufficientResources, TransactionRollback)
+
+
+def is_transient(e):
+    # A plain OperationalError is a lost connection, its subclasses (e.g ProgramLimitExceeded) are about the data
+    return isinstance(e, TRANSIENT_ERRORS) or type(e) is psycopg2.OperationalError
+
+
+def flush_votes(con, votes, row_by_row=False):
+    # A participant answers a question once, the first queued vote wins like ON CONFLICT DO NOTHING would
+    unique = {}
+    for vote in votes:
+        unique.setdefault(vote[:3], vote)
+    votes = list(unique.values())
+    if not row_by_row:
+        try:
+            with con:
+                votes_copy(con, votes)
+            return
+        except Exception as e:
+            if is_transient(e):
+                raise
+        # Some vote already exists (or is invalid), COPY can't skip it, so INSERT ... ON CONFLICT instead
+        by_session = {}
+        for session_id, *vote in votes:
+            by_session.setdefault(session_id, []).append(tuple(vote))
+        try:
+            with con:
+                for session_id, session_votes in by_session.items():
+                    votes_bulk_create(con, session_id, session_votes)
+            return
+        except Exception as e:
+            if is_transient(e):
+                raise
+    # Still failing, e.g a participant that doesn't exist - write them one by one so only the bad ones are lost.
+    # Votes already written here are skipped by ON CONFLICT if the batch is tried again
+    for session_id, *vote in votes:
+        try:
+            with con:
+                votes_bulk_create(con, session_id, [tuple(vote)])
+        except Exception as e:
+            if is_transient(e):
+                raise
+            print(" Error, dropped vote:", (session_id, *vote), e)
+
+
+async def vote_writer():
+    loop = asyncio.get_running_loop()
+    while True:
+        votes = [await vote_queue.get()]
+        deadline = loop.time() + VOTE_FLUSH_INTERVAL
+        while len(votes) < VOTE_FLUSH_ROWS:
+            try:
+                votes.append(await asyncio.wait_for(vote_queue.get(), deadline - loop.time()))
+            except asyncio.TimeoutError:
+                break
+        # These votes were already answered with 202, so keep trying until they are written
+        delay = 0.1
+        attempts = 0
+        while True:
+            try:
+                async with pooled_connection() as con:
+                    await run_in_threadpool(flush_votes, con, votes, attempts >= VOTE_RETRY_ATTEMPTS)
+                break
+            except Exception as e:
+                attempts += 1
+                print(" Error writing votes, retrying:", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, VOTE_RETRY_MAX_DELAY)
+        for _ in votes:
+            vote_queue.task_done()
+
+
+vote_decoder = msgspec.json.Decoder(VoteCreate)
+
+
+@app.post("/sessions/{session_id}/votes/buffered", status_code=202)
+async def add_vote_buffered(request: Request, session_id: int = Path(ge=1, le=2**63 - 1)) -> dict:
+    # Bytes -> VoteCreate in one pass, instead of json.loads + pydantic validation
+    try:
+        vote = vote_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if (vote.option_id is None) == (vote.text_answer is None):
+        raise HTTPException(status_code=400, detail="Give either option_id or text_answer")
+    try:
+        vote_queue.put_nowait((session_id, vote.participant_id, vote.question_id, vote.option_id, vote.text_answer))
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Too many votes waiting, try again")
+    return {"queued": True}
+
+
+@app.websocket("/sessions/{session_id}/votes/ws")
+async def votes_websocket(websocket: WebSocket, session_id: int):
+    # Pushes every new vote in the session as {"id", "question_id", "option_id"}
+    await websocket.accept()
+    queue = await subscribe_votes(session_id)
+
+    async def forward_votes():
+        while (payload := await queue.get()) is not None:
+            await websocket.send_text(payload)
+        # Fell too far behind, the client has to reconnect (and reload the votes it missed)
+        await websocket.close(code=1013)
+
+    async def wait_for_disconnect():
+        # Nothing is expected from the client, but receiving is how we notice it leaving
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    tasks = [asyncio.create_task(forward_votes()), asyncio.create_task(wait_for_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await unsubscribe_votes(session_id, queue)
+
+
+@app.get("/sessions/{session_id}/votes/stream")
+def stream_votes(session_id: int):
+    return StreamingResponse(ndjson_stream(votes_stream_for_session, session_id),
+                             media_type="application/x-ndjson")
+
+
+@app.get("/sessions/{session_id}/qna/stream")
+def stream_qna_messages(session_id: int):
+    return StreamingResponse(ndjson_stream(qna_messages_stream_for_session, session_id),
+                             media_type="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop (libuv) event loop and the httptools parser, both come with fastapi[standard]
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
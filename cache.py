@@ -0,0 +1,74 @@
+import os
+
+import orjson
+from db import PRESENTATIONS_GET_ROW_SQL, _numbered
+from db_setup import get_pool
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+"""
+REDIS CACHE
+-----------
+Cache-aside for read-mostly data: look in Redis first, on a miss read
+Postgres (through the asyncpg pool) and store the result with a TTL.
+If Redis is down the functions just read Postgres.
+question_types is not here, db.py keeps it in memory (question_types_list).
+"""
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+PRESENTATION_TTL = 300  # seconds
+# pres:<id>:v counts the updates of a presentation, it must outlive every cached copy
+PRESENTATION_VERSION_TTL = 24 * 3600
+
+# Connects on first use, so importing this module never needs Redis to be up
+redis = aioredis.from_url(REDIS_URL)
+
+
+async def _cache_set(key, value, ttl):
+    try:
+        await redis.set(key, orjson.dumps(value), ex=ttl)
+    except RedisError as e:
+        print(" Error writing cache:", e)
+
+
+async def close_cache():
+    await redis.aclose()
+
+
+# db.py's query, with asyncpg's $n placeholders
+PRESENTATION_SQL = _numbered(PRESENTATIONS_GET_ROW_SQL)
+
+async def get_presentation(presentation_id: int):
+    key = f"pres:{presentation_id}"
+    try:
+        cached, version = await redis.mget(key, f"{key}:v")
+    except RedisError as e:
+        print(" Error reading cache:", e)
+        cached = version = None
+    version = int(version or 0)
+    if cached is not None:
+        cached = orjson.loads(cached)
+        # An older version was stored by a miss that read the row before an update committed
+        if cached["version"] == version:
+            return cached["presentation"]
+    pool = await get_pool()
+    row = await pool.fetchrow(PRESENTATION_SQL, presentation_id)
+    if row is None:
+        return None
+    # Through orjson and back, so a hit and a miss return the same values (e.g dates as strings)
+    presentation = orjson.loads(orjson.dumps(dict(row)))
+    # Tagged with the version read before the query, an update meanwhile moves the version on
+    await _cache_set(key, {"version": version, "presentation": presentation}, PRESENTATION_TTL)
+    return presentation
+
+
+async def invalidate_presentation(presentation_id: int):
+    # Call after an update or delete of the presentation is committed, so the next read goes to Postgres.
+    # Bumping the version also rejects a copy that a read running right now stores afterwards
+    key = f"pres:{presentation_id}"
+    try:
+        async with redis.pipeline() as pipe:
+            await pipe.incr(f"{key}:v").expire(f"{key}:v", PRESENTATION_VERSION_TTL).delete(key).execute()
+    except RedisError as e:
+        print(" Error invalidating cache:", e)
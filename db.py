@@ -26,9 +26,17 @@ start with a connection parameter.
 """
 
 
-import json
-
-from psycopg2.extras import RealDictCursor
+import io
+import re
+import struct
+import time
+from functools import lru_cache
+
+import orjson
+from db_setup import USE_PREPARED_STATEMENTS
+from psycopg2.extensions import register_adapter
+from psycopg2.extras import Json, RealDictCursor, execute_values
+from pydantic import BaseModel
 
 """
 DATABASE FUNCTIONS
@@ -36,546 +44,915 @@ DATABASE FUNCTIONS
 All database operations are here.
 Each function takes conn first.
 Uses:
-- with conn: auto commit/rollback
+- no commits here: the caller owns the transaction (get_db in db_setup.py
+  wraps each request in one), so a request is a single BEGIN/COMMIT
 - RealDictCursor: returns dict rows
 - RETURNING: proves insert/update/delete worked
+- SQL lives in module level constants, so the exact same text is sent every time
 """
 
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode()
+
+
+# dicts passed as query parameters are sent as JSON, encoded with orjson
+register_adapter(dict, lambda d: Json(d, dumps=_orjson_dumps))
+
+
+def _settings(settings):
+    # Question settings as a dict, whether given as a QuestionSettings model (schemas.py), a dict or None
+    if isinstance(settings, BaseModel):
+        return settings.model_dump()
+    return settings or {}
+
+
+def _cur(conn):
+    # A dict-row cursor; it is its own context manager, so: with _cur(conn) as cur
+    return conn.cursor(cursor_factory=RealDictCursor)
+
+
+def _numbered(sql):
+    # PREPARE wants $1, $2, ... where psycopg2 uses %s
+    counter = iter(range(1, sql.count("%s") + 1))
+    return re.sub(r"%s", lambda _: f"${next(counter)}", sql)
+
+
+def _execute(cur, name, sql, params=(), types=None):
+    """
+    Runs sql as the server-side prepared statement `name`.
+    The statement is PREPAREd the first time a connection runs it, after
+    that Postgres skips parsing and planning and only executes it.
+    `types` optionally declares the parameter types, e.g ("int", "text").
+    """
+    prepared = getattr(cur.connection, "prepared", None)
+    if not USE_PREPARED_STATEMENTS or prepared is None:
+        cur.execute(sql, params)
+        return
+    if name not in prepared:
+        declared = f" ({', '.join(types)})" if types else ""
+        cur.execute(f"PREPARE {name}{declared} AS {_numbered(sql)}")
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+# table -> (extra SET clause, RETURNING columns) for the *_patch functions
+_PATCH_TABLES = {
+    "users": (", updated_at = now()", "id, email, avatar_url, role, created_at, updated_at"),
+    "live_sessions": ("", "id, presentation_id, access_code, status, current_question_id, created_at, started_at, ended_at"),
+    "qna_messages": ("", "id, session_id, participant_id, text, is_answered, is_hidden, created_at"),
+}
+
+
+@lru_cache(maxsize=64)
+def _patch_sql(table, columns):
+    """
+    UPDATE statement for a PATCH of `columns` (a tuple) on `table`.
+    There are only a few combinations per table, so each is built once.
+    The IS DISTINCT FROM check skips the write when every value is already what we'd set.
+    """
+    set_extra, returning = _PATCH_TABLES[table]
+    return f"""
+        UPDATE {table}
+        SET {", ".join(c + " = %s" for c in columns)}{set_extra}
+        WHERE id = %s AND ({", ".join(columns)}) IS DISTINCT FROM ({", ".join(["%s"] * len(columns))})
+        RETURNING {returning};
+    """
+
+
+def _patch(conn, table, row_id, columns, values, get_row):
+    """
+    Runs the PATCH of `columns` to `values` on row `row_id` of `table`.
+    When nothing changes (or there is no such row) the UPDATE returns nothing,
+    then the row is read as it is with get_row (e.g users_get)
+    """
+    with _cur(conn) as cur:
+        cur.execute(_patch_sql(table, tuple(columns)), values + [row_id] + values)
+        if cur.rowcount == 0:
+            return get_row(conn, row_id)
+        return cur.fetchone()
+
+
+# Tables with plain, fixed-shape accessors: their SQL is built once, below, at import time
+TABLES = {
+    "users": {"cols": ("id", "email", "avatar_url", "role", "created_at", "updated_at")},
+    "live_sessions": {"cols": ("id", "presentation_id", "access_code", "status", "current_question_id",
+                               "created_at", "started_at", "ended_at")},
+    "qna_messages": {"cols": ("id", "session_id", "participant_id", "text", "is_answered", "is_hidden",
+                              "created_at")},
+}
+
+
+def _make_list(table):
+    # Pages of `limit` rows by id, pass the last id you got as after_id to get the next page
+    sql = f"SELECT {', '.join(TABLES[table]['cols'])} FROM {table} WHERE id > %s ORDER BY id LIMIT %s;"
+
+    def list_rows(conn, limit: int = 200, after_id: int = 0):
+        with _cur(conn) as cur:
+            cur.execute(sql, (after_id, limit))
+            return cur.fetchall()
+
+    return list_rows
+
+
+def _make_get(table):
+    sql = f"SELECT {', '.join(TABLES[table]['cols'])} FROM {table} WHERE id = %s;"
+
+    def get_row(conn, row_id: int):
+        with _cur(conn) as cur:
+            cur.execute(sql, (row_id,))
+            return cur.fetchone()
+
+    return get_row
+
+
+def _make_delete(table):
+    sql = f"DELETE FROM {table} WHERE id = %s RETURNING id;"
+
+    def delete_row(conn, row_id: int) -> bool:
+        with _cur(conn) as cur:
+            cur.execute(sql, (row_id,))
+            return cur.fetchone() is not None
+
+    return delete_row
+
+
+def _make_stream(name, sql, cols):
+    # Every row of a session through a server-side (named) cursor,
+    # rows arrive itersize at a time instead of all at once
+    def stream_rows(conn, session_id: int, itersize=1000):
+        with conn.cursor(name=name) as cur:
+            cur.itersize = itersize
+            cur.execute(sql, (session_id,))
+            for row in cur:
+                yield dict(zip(cols, row))
+
+    return stream_rows
+
+
 # ============================================
 # USERS
 # ============================================
 
-def users_list(conn):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, email, avatar_url, role, created_at, updated_at
-                FROM users
-                ORDER BY id;
-            """)
-            return cur.fetchall()
+users_list = _make_list("users")
 
-def users_get(conn, user_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, email, avatar_url, role, created_at, updated_at
-                FROM users
-                WHERE id = %s;
-            """, (user_id,))
-            return cur.fetchone()
+users_get = _make_get("users")
+
+USERS_CREATE_SQL = """
+    INSERT INTO users (email, password_hash, avatar_url, role)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (email) DO NOTHING
+    RETURNING id, email, avatar_url, role, created_at, updated_at;
+"""
 
 def users_create(conn, email: str, password_hash: str, avatar_url=None, role="teacher"):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO users (email, password_hash, avatar_url, role)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, email, avatar_url, role, created_at, updated_at;
-            """, (email, password_hash, avatar_url, role))
-            return cur.fetchone()
+    # Returns None when the email is already taken (without touching or revealing that user)
+    with _cur(conn) as cur:
+        cur.execute(USERS_CREATE_SQL, (email, password_hash, avatar_url, role))
+        return cur.fetchone()
+
+USERS_UPDATE_SQL = """
+    UPDATE users
+    SET email = %s,
+        password_hash = %s,
+        avatar_url = %s,
+        role = %s,
+        updated_at = now()
+    WHERE id = %s
+    RETURNING id, email, avatar_url, role, created_at, updated_at;
+"""
 
 def users_update(conn, user_id: int, email: str, password_hash: str, avatar_url, role: str):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE users
-                SET email = %s,
-                    password_hash = %s,
-                    avatar_url = %s,
-                    role = %s,
-                    updated_at = now()
-                WHERE id = %s
-                RETURNING id, email, avatar_url, role, created_at, updated_at;
-            """, (email, password_hash, avatar_url, role, user_id))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(USERS_UPDATE_SQL, (email, password_hash, avatar_url, role, user_id))
+        return cur.fetchone()
 
 def users_patch(conn, user_id: int, email=None, password_hash=None, avatar_url=None, role=None):
     # SAFE PATCH (whitelist)
-    updates = []
+    columns = []
     values = []
 
     if email is not None:
-        updates.append("email = %s")
+        columns.append("email")
         values.append(email)
     if password_hash is not None:
-        updates.append("password_hash = %s")
+        columns.append("password_hash")
         values.append(password_hash)
     if avatar_url is not None:
-        updates.append("avatar_url = %s")
+        columns.append("avatar_url")
         values.append(avatar_url)
     if role is not None:
-        updates.append("role = %s")
+        columns.append("role")
         values.append(role)
 
-    if not updates:
+    if not columns:
         return None
 
-    values.append(user_id)
-
-    sql = f"""
-        UPDATE users
-        SET {", ".join(updates)}, updated_at = now()
-        WHERE id = %s
-        RETURNING id, email, avatar_url, role, created_at, updated_at;
-    """
-
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(sql, values)
-            return cur.fetchone()
+    return _patch(conn, "users", user_id, columns, values, users_get)
 
-def users_delete(conn, user_id: int) -> bool:
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("DELETE FROM users WHERE id = %s RETURNING id;", (user_id,))
-            return cur.fetchone() is not None
+users_delete = _make_delete("users")
 
 
 # ============================================
 # PRESENTATIONS
 # ============================================
 
-def presentations_list(conn):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT p.id, p.owner_id, p.title, p.created_at, p.updated_at,
-                    u.email AS owner_email
-                FROM presentations p
-                JOIN users u ON u.id = p.owner_id
-                ORDER BY p.created_at DESC;
-            """)
-            return cur.fetchall()
+_PRESENTATIONS_LIST_TEMPLATE = """
+    SELECT COALESCE(json_agg(json_build_object(
+            'id', p.id, 'owner_id', p.owner_id, 'title', p.title,
+            'created_at', p.created_at, 'updated_at', p.updated_at,
+            'owner_email', u.email
+        ) ORDER BY p.id DESC), '[]')::text
+    FROM (
+        SELECT id, owner_id, title, created_at, updated_at
+        FROM presentations
+        {where}
+        ORDER BY id DESC
+        LIMIT %s
+    ) p
+    JOIN users u ON u.id = p.owner_id;
+"""
+PRESENTATIONS_LIST_SQL = _PRESENTATIONS_LIST_TEMPLATE.format(where="")
+PRESENTATIONS_LIST_BEFORE_SQL = _PRESENTATIONS_LIST_TEMPLATE.format(where="WHERE id < %s")
+
+def presentations_list(conn, limit: int = 200, before_id=None) -> str:
+    # Postgres builds the whole JSON array, we get it back as one string.
+    # Newest first, pass the last id you got as before_id to get the next page
+    with conn.cursor() as cur:
+        if before_id is None:
+            _execute(cur, "presentations_list", PRESENTATIONS_LIST_SQL, (limit,))
+        else:
+            _execute(cur, "presentations_list_before", PRESENTATIONS_LIST_BEFORE_SQL, (before_id, limit))
+        return cur.fetchone()[0]
+
+PRESENTATIONS_GET_SQL = """
+    SELECT p.id, p.owner_id, p.title, p.created_at, p.updated_at,
+        u.email AS owner_email
+    FROM presentations p
+    JOIN users u ON u.id = p.owner_id
+    WHERE p.id = %s;
+"""
+
+# Just the presentation row, for caching (see cache.py): without the owner's email,
+# a changed email can't leave a cached presentation stale
+PRESENTATIONS_GET_ROW_SQL = """
+    SELECT id, owner_id, title, created_at, updated_at
+    FROM presentations
+    WHERE id = %s;
+"""
 
 def presentations_get(conn, presentation_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT p.id, p.owner_id, p.title, p.created_at, p.updated_at,
-                    u.email AS owner_email
-                FROM presentations p
-                JOIN users u ON u.id = p.owner_id
-                WHERE p.id = %s;
-            """, (presentation_id,))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(PRESENTATIONS_GET_SQL, (presentation_id,))
+        return cur.fetchone()
+
+PRESENTATIONS_CREATE_SQL = """
+    INSERT INTO presentations (owner_id, title)
+    VALUES (%s, %s)
+    RETURNING id, owner_id, title, created_at, updated_at;
+"""
 
 def presentations_create(conn, owner_id: int, title: str):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO presentations (owner_id, title)
-                VALUES (%s, %s)
-                RETURNING id, owner_id, title, created_at, updated_at;
-            """, (owner_id, title))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(PRESENTATIONS_CREATE_SQL, (owner_id, title))
+        return cur.fetchone()
+
+PRESENTATIONS_CREATE_WITH_QUESTIONS_SQL = """
+    WITH p AS (
+        INSERT INTO presentations (owner_id, title)
+        VALUES (%s, %s)
+        RETURNING id, owner_id, title, created_at, updated_at
+    ), q AS (
+        INSERT INTO questions (presentation_id, type_code, text, media_url, order_index, settings)
+        SELECT p.id, v.type_code, v.text, v.media_url, v.order_index, v.settings
+        FROM p
+        CROSS JOIN unnest(%s::text[], %s::text[], %s::text[], %s::int[], %s::jsonb[])
+            AS v(type_code, text, media_url, order_index, settings)
+        RETURNING id, presentation_id, type_code, text, media_url, order_index, settings, created_at, updated_at
+    )
+    SELECT p.id, p.owner_id, p.title, p.created_at, p.updated_at,
+        COALESCE((SELECT json_agg(q ORDER BY q.order_index, q.id) FROM q), '[]') AS questions
+    FROM p;
+"""
+
+def presentations_create_with_questions(conn, owner_id: int, title: str, questions: list[dict]):
+    # One statement creates the presentation and all of its questions (dicts with the
+    # questions_create arguments), each question column is sent as one array
+    params = (
+        owner_id,
+        title,
+        [q["type_code"] for q in questions],
+        [q["text"] for q in questions],
+        [q.get("media_url") for q in questions],
+        [q.get("order_index", 0) for q in questions],
+        [_settings(q.get("settings")) for q in questions],
+    )
+    with _cur(conn) as cur:
+        cur.execute(PRESENTATIONS_CREATE_WITH_QUESTIONS_SQL, params)
+        return cur.fetchone()
+
+PRESENTATIONS_UPDATE_SQL = """
+    UPDATE presentations
+    SET owner_id = %s,
+        title = %s,
+        updated_at = now()
+    WHERE id = %s
+    RETURNING id, owner_id, title, created_at, updated_at;
+"""
 
 def presentations_update(conn, presentation_id: int, owner_id: int, title: str):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE presentations
-                SET owner_id = %s,
-                    title = %s,
-                    updated_at = now()
-                WHERE id = %s
-                RETURNING id, owner_id, title, created_at, updated_at;
-            """, (owner_id, title, presentation_id))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(PRESENTATIONS_UPDATE_SQL, (owner_id, title, presentation_id))
+        return cur.fetchone()
 
-def presentations_delete(conn, presentation_id: int) -> bool:
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("DELETE FROM presentations WHERE id = %s RETURNING id;", (presentation_id,))
-            return cur.fetchone() is not None
+presentations_delete = _make_delete("presentations")
 
 
 # ============================================
 # QUESTION TYPES
 # ============================================
 
+QUESTION_TYPES_LIST_SQL = """
+    SELECT code, label, uses_options, allows_text_answer
+    FROM question_types
+    ORDER BY code;
+"""
+
+QUESTION_TYPES_TTL = 300  # seconds
+
+# question_types hardly ever changes, so a copy is kept in memory for QUESTION_TYPES_TTL seconds
+_question_types_cache = {"ts": 0.0, "rows": None, "labels": None}
+
 def question_types_list(conn):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT code, label, uses_options, allows_text_answer
-                FROM question_types
-                ORDER BY code;
-            """)
-            return cur.fetchall()
+    if _question_types_cache["rows"] is None or time.monotonic() - _question_types_cache["ts"] > QUESTION_TYPES_TTL:
+        with _cur(conn) as cur:
+            cur.execute(QUESTION_TYPES_LIST_SQL)
+            rows = cur.fetchall()
+        _question_types_cache.update(rows=rows, labels={r["code"]: r["label"] for r in rows}, ts=time.monotonic())
+    return _question_types_cache["rows"]
+
+def _add_type_labels(conn, questions):
+    # Fills in type_label from the cached question types instead of joining question_types
+    question_types_list(conn)
+    labels = _question_types_cache["labels"]
+    for question in questions:
+        question["type_label"] = labels.get(question["type_code"])
+    return questions
 
 
 # ============================================
 # QUESTIONS
 # ============================================
 
+QUESTIONS_LIST_FOR_PRESENTATION_SQL = """
+    SELECT id, presentation_id, type_code, text, media_url,
+        order_index, settings, created_at, updated_at
+    FROM questions
+    WHERE presentation_id = %s
+    ORDER BY order_index, id;
+"""
+
 def questions_list_for_presentation(conn, presentation_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT q.id, q.presentation_id, q.type_code, q.text, q.media_url,
-                    q.order_index, q.settings, q.created_at, q.updated_at,
-                    qt.label AS type_label
-                FROM questions q
-                JOIN question_types qt ON qt.code = q.type_code
-                WHERE q.presentation_id = %s
-                ORDER BY q.order_index, q.id;
-            """, (presentation_id,))
-            return cur.fetchall()
+    with _cur(conn) as cur:
+        _execute(cur, "questions_list_for_presentation", QUESTIONS_LIST_FOR_PRESENTATION_SQL, (presentation_id,))
+        questions = cur.fetchall()
+    return _add_type_labels(conn, questions)
+
+QUESTIONS_GET_SQL = """
+    SELECT id, presentation_id, type_code, text, media_url,
+        order_index, settings, created_at, updated_at
+    FROM questions
+    WHERE id = %s;
+"""
 
 def questions_get(conn, question_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT q.id, q.presentation_id, q.type_code, q.text, q.media_url,
-                    q.order_index, q.settings, q.created_at, q.updated_at,
-                    qt.label AS type_label
-                FROM questions q
-                JOIN question_types qt ON qt.code = q.type_code
-                WHERE q.id = %s;
-            """, (question_id,))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(QUESTIONS_GET_SQL, (question_id,))
+        question = cur.fetchone()
+    if question is None:
+        return None
+    return _add_type_labels(conn, [question])[0]
+
+QUESTIONS_CREATE_SQL = """
+    INSERT INTO questions (presentation_id, type_code, text, media_url, order_index, settings)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    RETURNING id, presentation_id, type_code, text, media_url, order_index, settings, created_at, updated_at;
+"""
 
 def questions_create(conn, presentation_id: int, type_code: str, text: str,
                     media_url=None, order_index=0, settings=None):
-    settings_json = json.dumps(settings or {})
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO questions (presentation_id, type_code, text, media_url, order_index, settings)
-                VALUES (%s, %s, %s, %s, %s, %s::jsonb)
-                RETURNING id, presentation_id, type_code, text, media_url, order_index, settings, created_at, updated_at;
-            """, (presentation_id, type_code, text, media_url, order_index, settings_json))
-            return cur.fetchone()
+    settings_json = Json(_settings(settings), dumps=_orjson_dumps)
+    with _cur(conn) as cur:
+        cur.execute(QUESTIONS_CREATE_SQL, (presentation_id, type_code, text, media_url, order_index, settings_json))
+        return cur.fetchone()
+
+QUESTIONS_CREATE_WITH_OPTIONS_SQL = """
+    WITH q AS (
+        INSERT INTO questions (presentation_id, type_code, text, media_url, order_index, settings)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        RETURNING id, presentation_id, type_code, text, media_url, order_index, settings, created_at, updated_at
+    ), o AS (
+        INSERT INTO options (question_id, text, is_correct, order_index)
+        SELECT q.id, v.text, v.is_correct, v.order_index
+        FROM q
+        CROSS JOIN unnest(%s::text[], %s::boolean[], %s::int[]) AS v(text, is_correct, order_index)
+        RETURNING id, question_id, text, is_correct, order_index
+    )
+    SELECT q.id, q.presentation_id, q.type_code, q.text, q.media_url, q.order_index, q.settings,
+        q.created_at, q.updated_at,
+        COALESCE((SELECT json_agg(o ORDER BY o.order_index, o.id) FROM o), '[]') AS options
+    FROM q;
+"""
+
+def questions_create_with_options(conn, presentation_id: int, type_code: str, text: str, options: list[tuple],
+                                  media_url=None, order_index=0, settings=None):
+    # One statement creates the question and its options: (text, is_correct, order_index) tuples
+    params = (
+        presentation_id, type_code, text, media_url, order_index, _settings(settings),
+        [o[0] for o in options],
+        [o[1] for o in options],
+        [o[2] for o in options],
+    )
+    with _cur(conn) as cur:
+        cur.execute(QUESTIONS_CREATE_WITH_OPTIONS_SQL, params)
+        return cur.fetchone()
+
+QUESTIONS_BULK_CREATE_SQL = """
+    INSERT INTO questions (presentation_id, type_code, text, media_url, order_index, settings)
+    VALUES %s
+    RETURNING id, presentation_id, type_code, text, media_url, order_index, settings, created_at, updated_at;
+"""
+
+def questions_bulk_create(conn, presentation_id: int, questions: list[tuple]):
+    # questions: (type_code, text, media_url, order_index, settings) tuples, inserted in one statement
+    rows = [
+        (presentation_id, type_code, text, media_url, order_index, _settings(settings))
+        for type_code, text, media_url, order_index, settings in questions
+    ]
+    with _cur(conn) as cur:
+        return execute_values(cur, QUESTIONS_BULK_CREATE_SQL, rows, page_size=500, fetch=True)
+
+QUESTIONS_UPDATE_SQL = """
+    UPDATE questions
+    SET presentation_id = %s,
+        type_code = %s,
+        text = %s,
+        media_url = %s,
+        order_index = %s,
+        settings = %s,
+        updated_at = now()
+    WHERE id = %s
+    RETURNING id, presentation_id, type_code, text, media_url, order_index, settings, created_at, updated_at;
+"""
 
 def questions_update(conn, question_id: int, presentation_id: int, type_code: str, text: str,
                     media_url, order_index: int, settings):
-    settings_json = json.dumps(settings or {})
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE questions
-                SET presentation_id = %s,
-                    type_code = %s,
-                    text = %s,
-                    media_url = %s,
-                    order_index = %s,
-                    settings = %s::jsonb,
-                    updated_at = now()
-                WHERE id = %s
-                RETURNING id, presentation_id, type_code, text, media_url, order_index, settings, created_at, updated_at;
-            """, (presentation_id, type_code, text, media_url, order_index, settings_json, question_id))
-            return cur.fetchone()
+    settings_json = Json(_settings(settings), dumps=_orjson_dumps)
+    with _cur(conn) as cur:
+        cur.execute(QUESTIONS_UPDATE_SQL, (presentation_id, type_code, text, media_url, order_index, settings_json, question_id))
+        return cur.fetchone()
 
-def questions_delete(conn, question_id: int) -> bool:
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("DELETE FROM questions WHERE id = %s RETURNING id;", (question_id,))
-            return cur.fetchone() is not None
+questions_delete = _make_delete("questions")
 
 
 # ============================================
 # OPTIONS
 # ============================================
 
+OPTIONS_LIST_FOR_QUESTION_SQL = """
+    SELECT id, question_id, text, is_correct, order_index
+    FROM options
+    WHERE question_id = %s
+    ORDER BY order_index, id;
+"""
+
 def options_list_for_question(conn, question_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, question_id, text, is_correct, order_index
-                FROM options
-                WHERE question_id = %s
-                ORDER BY order_index, id;
-            """, (question_id,))
-            return cur.fetchall()
+    with _cur(conn) as cur:
+        cur.execute(OPTIONS_LIST_FOR_QUESTION_SQL, (question_id,))
+        return cur.fetchall()
+
+OPTIONS_CREATE_SQL = """
+    INSERT INTO options (question_id, text, is_correct, order_index)
+    VALUES (%s, %s, %s, %s)
+    RETURNING id, question_id, text, is_correct, order_index;
+"""
 
 def options_create(conn, question_id: int, text: str, is_correct=False, order_index=0):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO options (question_id, text, is_correct, order_index)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, question_id, text, is_correct, order_index;
-            """, (question_id, text, is_correct, order_index))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(OPTIONS_CREATE_SQL, (question_id, text, is_correct, order_index))
+        return cur.fetchone()
+
+OPTIONS_BULK_CREATE_SQL = """
+    INSERT INTO options (question_id, text, is_correct, order_index)
+    VALUES %s
+    RETURNING id, question_id, text, is_correct, order_index;
+"""
+
+def options_bulk_create(conn, question_id: int, options: list[tuple]):
+    # options: (text, is_correct, order_index) tuples, inserted in one statement
+    # (a question has few options, so they always go in a single page/statement)
+    rows = [(question_id, text, is_correct, order_index) for text, is_correct, order_index in options]
+    with _cur(conn) as cur:
+        return execute_values(cur, OPTIONS_BULK_CREATE_SQL, rows, page_size=max(len(rows), 1), fetch=True)
+
+OPTIONS_UPDATE_SQL = """
+    UPDATE options
+    SET question_id = %s,
+        text = %s,
+        is_correct = %s,
+        order_index = %s
+    WHERE id = %s
+    RETURNING id, question_id, text, is_correct, order_index;
+"""
 
 def options_update(conn, option_id: int, question_id: int, text: str, is_correct: bool, order_index: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE options
-                SET question_id = %s,
-                    text = %s,
-                    is_correct = %s,
-                    order_index = %s
-                WHERE id = %s
-                RETURNING id, question_id, text, is_correct, order_index;
-            """, (question_id, text, is_correct, order_index, option_id))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(OPTIONS_UPDATE_SQL, (question_id, text, is_correct, order_index, option_id))
+        return cur.fetchone()
 
-def options_delete(conn, option_id: int) -> bool:
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("DELETE FROM options WHERE id = %s RETURNING id;", (option_id,))
-            return cur.fetchone() is not None
+options_delete = _make_delete("options")
 
 
 # ============================================
 # LIVE SESSIONS
 # ============================================
 
-def sessions_list(conn):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT ls.id, ls.presentation_id, ls.access_code, ls.status,
-                    ls.current_question_id, ls.created_at, ls.started_at, ls.ended_at,
-                    p.title AS presentation_title
-                FROM live_sessions ls
-                JOIN presentations p ON p.id = ls.presentation_id
-                ORDER BY ls.created_at DESC;
-            """)
-            return cur.fetchall()
-
-def sessions_get(conn, session_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, presentation_id, access_code, status, current_question_id,
-                    created_at, started_at, ended_at
-                FROM live_sessions
-                WHERE id = %s;
-            """, (session_id,))
-            return cur.fetchone()
+_SESSIONS_LIST_TEMPLATE = """
+    SELECT ls.id, ls.presentation_id, ls.access_code, ls.status,
+        ls.current_question_id, ls.created_at, ls.started_at, ls.ended_at,
+        p.title AS presentation_title
+    FROM live_sessions ls
+    JOIN presentations p ON p.id = ls.presentation_id
+    {where}
+    ORDER BY ls.id DESC
+    LIMIT %s;
+"""
+SESSIONS_LIST_SQL = _SESSIONS_LIST_TEMPLATE.format(where="")
+SESSIONS_LIST_BEFORE_SQL = _SESSIONS_LIST_TEMPLATE.format(where="WHERE ls.id < %s")
+
+def sessions_list(conn, limit: int = 200, before_id=None):
+    # Newest first, pass the last id you got as before_id to get the next page
+    with _cur(conn) as cur:
+        if before_id is None:
+            cur.execute(SESSIONS_LIST_SQL, (limit,))
+        else:
+            cur.execute(SESSIONS_LIST_BEFORE_SQL, (before_id, limit))
+        return cur.fetchall()
+
+sessions_get = _make_get("live_sessions")
+
+SESSIONS_GET_BY_CODE_SQL = """
+    SELECT id, presentation_id, access_code, status, current_question_id,
+        created_at, started_at, ended_at
+    FROM live_sessions
+    WHERE access_code = %s;
+"""
 
 def sessions_get_by_code(conn, access_code: str):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, presentation_id, access_code, status, current_question_id,
-                    created_at, started_at, ended_at
-                FROM live_sessions
-                WHERE access_code = %s;
-            """, (access_code,))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(SESSIONS_GET_BY_CODE_SQL, (access_code,))
+        return cur.fetchone()
+
+SESSIONS_CREATE_SQL = """
+    INSERT INTO live_sessions (presentation_id, access_code, status, current_question_id)
+    VALUES (%s, %s, %s, %s)
+    RETURNING id, presentation_id, access_code, status, current_question_id, created_at, started_at, ended_at;
+"""
 
 def sessions_create(conn, presentation_id: int, access_code: str, status="created", current_question_id=None):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO live_sessions (presentation_id, access_code, status, current_question_id)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, presentation_id, access_code, status, current_question_id, created_at, started_at, ended_at;
-            """, (presentation_id, access_code, status, current_question_id))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(SESSIONS_CREATE_SQL, (presentation_id, access_code, status, current_question_id))
+        return cur.fetchone()
+
+SESSIONS_UPDATE_SQL = """
+    UPDATE live_sessions
+    SET presentation_id = %s,
+        access_code = %s,
+        status = %s,
+        current_question_id = %s
+    WHERE id = %s
+    RETURNING id, presentation_id, access_code, status, current_question_id, created_at, started_at, ended_at;
+"""
 
 def sessions_update(conn, session_id: int, presentation_id: int, access_code: str, status: str, current_question_id=None):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                UPDATE live_sessions
-                SET presentation_id = %s,
-                    access_code = %s,
-                    status = %s,
-                    current_question_id = %s
-                WHERE id = %s
-                RETURNING id, presentation_id, access_code, status, current_question_id, created_at, started_at, ended_at;
-            """, (presentation_id, access_code, status, current_question_id, session_id))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        cur.execute(SESSIONS_UPDATE_SQL, (presentation_id, access_code, status, current_question_id, session_id))
+        return cur.fetchone()
 
 def sessions_patch(conn, session_id: int, status=None, current_question_id=None):
-    updates = []
+    columns = []
     values = []
 
     if status is not None:
-        updates.append("status = %s")
+        columns.append("status")
         values.append(status)
     if current_question_id is not None:
-        updates.append("current_question_id = %s")
+        columns.append("current_question_id")
         values.append(current_question_id)
 
-    if not updates:
+    if not columns:
         return None
 
-    values.append(session_id)
+    return _patch(conn, "live_sessions", session_id, columns, values, sessions_get)
 
-    sql = f"""
-        UPDATE live_sessions
-        SET {", ".join(updates)}
-        WHERE id = %s
-        RETURNING id, presentation_id, access_code, status, current_question_id, created_at, started_at, ended_at;
-    """
-
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(sql, values)
-            return cur.fetchone()
-
-def sessions_delete(conn, session_id: int) -> bool:
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("DELETE FROM live_sessions WHERE id = %s RETURNING id;", (session_id,))
-            return cur.fetchone() is not None
+sessions_delete = _make_delete("live_sessions")
 
 
 # ============================================
 # PARTICIPANTS
 # ============================================
 
+PARTICIPANT_COLS = ("id", "session_id", "nickname", "joined_at")
+
+PARTICIPANTS_LIST_FOR_SESSION_SQL = """
+    SELECT id, session_id, nickname, joined_at
+    FROM participants
+    WHERE session_id = %s
+    ORDER BY joined_at, id;
+"""
+
 def participants_list_for_session(conn, session_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, session_id, nickname, joined_at
-                FROM participants
-                WHERE session_id = %s
-                ORDER BY joined_at, id;
-            """, (session_id,))
-            return cur.fetchall()
+    with conn.cursor() as cur:
+        cur.execute(PARTICIPANTS_LIST_FOR_SESSION_SQL, (session_id,))
+        return [dict(zip(PARTICIPANT_COLS, row)) for row in cur.fetchall()]
+
+PARTICIPANTS_CREATE_SQL = """
+    INSERT INTO participants (session_id, nickname)
+    VALUES (%s, %s)
+    ON CONFLICT (session_id, nickname) DO NOTHING
+    RETURNING id, session_id, nickname, joined_at;
+"""
+PARTICIPANTS_CREATE_TYPES = ("bigint", "text")
 
 def participants_create(conn, session_id: int, nickname: str):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO participants (session_id, nickname)
-                VALUES (%s, %s)
-                RETURNING id, session_id, nickname, joined_at;
-            """, (session_id, nickname))
-            return cur.fetchone()
+    # Returns None when the nickname is already taken in the session, so two people never share one participant
+    with _cur(conn) as cur:
+        _execute(cur, "participants_create", PARTICIPANTS_CREATE_SQL, (session_id, nickname),
+                 types=PARTICIPANTS_CREATE_TYPES)
+        return cur.fetchone()
 
-def participants_delete(conn, participant_id: int) -> bool:
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("DELETE FROM participants WHERE id = %s RETURNING id;", (participant_id,))
-            return cur.fetchone() is not None
+participants_delete = _make_delete("participants")
 
 
 # ============================================
 # VOTES
 # ============================================
 
-def votes_list_for_session(conn, session_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT v.id, v.session_id, v.participant_id, v.question_id, v.option_id, v.text_answer, v.created_at,
-                    p.nickname,
-                    q.text AS question_text
-                FROM votes v
-                JOIN participants p ON p.id = v.participant_id
-                JOIN questions q ON q.id = v.question_id
-                WHERE v.session_id = %s
-                ORDER BY v.created_at, v.id;
-            """, (session_id,))
-            return cur.fetchall()
+# Plain tuple rows are cheaper than RealDictCursor on big lists, these name their columns
+VOTE_COLS = ("id", "session_id", "participant_id", "question_id", "option_id", "text_answer", "created_at",
+             "nickname", "question_text")
+
+_VOTES_LIST_TEMPLATE = """
+    SELECT v.id, v.session_id, v.participant_id, v.question_id, v.option_id, v.text_answer, v.created_at,
+        p.nickname,
+        q.text AS question_text
+    FROM votes v
+    JOIN participants p ON p.id = v.participant_id
+    JOIN questions q ON q.id = v.question_id
+    WHERE v.session_id = %s {where}
+    ORDER BY v.created_at, v.id
+    {limit};
+"""
+VOTES_LIST_FOR_SESSION_SQL = _VOTES_LIST_TEMPLATE.format(where="", limit="LIMIT %s")
+# Next page: continues right after the last (created_at, id) the caller got
+VOTES_LIST_FOR_SESSION_AFTER_SQL = _VOTES_LIST_TEMPLATE.format(
+    where="AND (v.created_at, v.id) > (%s, %s)", limit="LIMIT %s")
+VOTES_STREAM_FOR_SESSION_SQL = _VOTES_LIST_TEMPLATE.format(where="", limit="")
+
+def votes_list_for_session(conn, session_id: int, after_created_at=None, after_id=None, limit=500):
+    with conn.cursor() as cur:
+        if after_created_at is None or after_id is None:
+            _execute(cur, "votes_list_for_session", VOTES_LIST_FOR_SESSION_SQL, (session_id, limit))
+        else:
+            _execute(cur, "votes_list_for_session_after", VOTES_LIST_FOR_SESSION_AFTER_SQL,
+                     (session_id, after_created_at, after_id, limit))
+        return [dict(zip(VOTE_COLS, row)) for row in cur.fetchall()]
+
+votes_stream_for_session = _make_stream("votes_stream", VOTES_STREAM_FOR_SESSION_SQL, VOTE_COLS)
+
+VOTES_LIST_FOR_QUESTION_SQL = """
+    SELECT v.id, v.session_id, v.participant_id, v.question_id, v.option_id, v.text_answer, v.created_at,
+        p.nickname
+    FROM votes v
+    JOIN participants p ON p.id = v.participant_id
+    WHERE v.session_id = %s AND v.question_id = %s
+    ORDER BY v.created_at, v.id;
+"""
 
 def votes_list_for_question(conn, session_id: int, question_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT v.id, v.session_id, v.participant_id, v.question_id, v.option_id, v.text_answer, v.created_at,
-                    p.nickname
-                FROM votes v
-                JOIN participants p ON p.id = v.participant_id
-                WHERE v.session_id = %s AND v.question_id = %s
-                ORDER BY v.created_at, v.id;
-            """, (session_id, question_id))
-            return cur.fetchall()
+    with _cur(conn) as cur:
+        cur.execute(VOTES_LIST_FOR_QUESTION_SQL, (session_id, question_id))
+        return cur.fetchall()
+
+VOTES_TALLY_FOR_QUESTION_SQL = """
+    SELECT option_id, COUNT(*) AS votes
+    FROM votes
+    WHERE session_id = %s AND question_id = %s AND option_id IS NOT NULL
+    GROUP BY option_id
+    ORDER BY option_id;
+"""
+
+def votes_tally_for_question(conn, session_id: int, question_id: int):
+    # Number of votes per option in one session, from idx_votes_session_question_option in the session's partition
+    with _cur(conn) as cur:
+        _execute(cur, "votes_tally_for_question", VOTES_TALLY_FOR_QUESTION_SQL, (session_id, question_id))
+        return cur.fetchall()
+
+VOTES_CREATE_SQL = """
+    INSERT INTO votes (session_id, participant_id, question_id, option_id, text_answer)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING id, session_id, participant_id, question_id, option_id, text_answer, created_at;
+"""
+VOTES_CREATE_TYPES = ("bigint", "bigint", "int", "int", "text")
 
 def votes_create(conn, session_id: int, participant_id: int, question_id: int, option_id=None, text_answer=None):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO votes (session_id, participant_id, question_id, option_id, text_answer)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id, session_id, participant_id, question_id, option_id, text_answer, created_at;
-            """, (session_id, participant_id, question_id, option_id, text_answer))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        _execute(cur, "votes_create", VOTES_CREATE_SQL, (session_id, participant_id, question_id, option_id, text_answer),
+                 types=VOTES_CREATE_TYPES)
+        return cur.fetchone()
+
+# A repeated vote is skipped instead of failing the whole batch
+VOTES_BULK_CREATE_SQL = """
+    INSERT INTO votes (session_id, participant_id, question_id, option_id, text_answer)
+    VALUES %s
+    ON CONFLICT (session_id, participant_id, question_id) DO NOTHING
+    RETURNING id, session_id, participant_id, question_id, option_id, text_answer, created_at;
+"""
+
+def votes_bulk_create(conn, session_id: int, votes: list[tuple]):
+    # votes: (participant_id, question_id, option_id, text_answer) tuples, inserted in one statement
+    rows = [
+        (session_id, participant_id, question_id, option_id, text_answer)
+        for participant_id, question_id, option_id, text_answer in votes
+    ]
+    with _cur(conn) as cur:
+        return execute_values(cur, VOTES_BULK_CREATE_SQL, rows, page_size=500, fetch=True)
+
+VOTES_COPY_SQL = """
+    COPY votes (session_id, participant_id, question_id, option_id, text_answer)
+    FROM STDIN WITH (FORMAT BINARY);
+"""
+
+# Binary COPY framing: signature, flags and header extension length, then rows, then -1
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+_COPY_NULL = struct.pack("!i", -1)
+
+
+def _copy_int4(value):
+    return _COPY_NULL if value is None else struct.pack("!ii", 4, value)
+
+
+def _copy_int8(value):
+    return _COPY_NULL if value is None else struct.pack("!iq", 8, value)
+
+
+def _copy_text(value):
+    if value is None:
+        return _COPY_NULL
+    data = value.encode()
+    return struct.pack("!i", len(data)) + data
+
+
+def _votes_copy_data(votes: list[tuple]) -> bytes:
+    # The COPY stream for votes_copy. An id that doesn't fit its column raises struct.error
+    buf = io.BytesIO()
+    buf.write(_COPY_HEADER)
+    for session_id, participant_id, question_id, option_id, text_answer in votes:
+        buf.write(struct.pack("!h", 5))
+        buf.write(_copy_int8(session_id))
+        buf.write(_copy_int8(participant_id))
+        buf.write(_copy_int4(question_id))
+        buf.write(_copy_int4(option_id))
+        buf.write(_copy_text(text_answer))
+    buf.write(_COPY_TRAILER)
+    return buf.getvalue()
+
+
+def votes_copy(conn, votes: list[tuple]):
+    """
+    Writes (session_id, participant_id, question_id, option_id, text_answer) rows
+    with COPY in binary format - the cheapest way to get many rows into Postgres.
+    COPY has no ON CONFLICT, so one repeated vote fails the whole batch; use
+    votes_bulk_create when that has to be skipped instead.
+    """
+    with conn.cursor() as cur:
+        cur.copy_expert(VOTES_COPY_SQL, io.BytesIO(_votes_copy_data(votes)))
+        return cur.rowcount
 
 
 # ============================================
 # Q&A MESSAGES
 # ============================================
 
-def qna_messages_list_for_session(conn, session_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT m.id, m.session_id, m.participant_id, m.text, m.is_answered, m.is_hidden, m.created_at,
-                    p.nickname,
-                    (SELECT COUNT(*) FROM qna_upvotes u WHERE u.message_id = m.id) AS upvote_count
-                FROM qna_messages m
-                LEFT JOIN participants p ON p.id = m.participant_id
-                WHERE m.session_id = %s
-                ORDER BY m.created_at DESC, m.id DESC;
-            """, (session_id,))
-            return cur.fetchall()
+QNA_MESSAGE_COLS = ("id", "session_id", "participant_id", "text", "is_answered", "is_hidden", "created_at",
+                    "nickname", "upvote_count")
+
+_QNA_MESSAGES_LIST_TEMPLATE = """
+    SELECT m.id, m.session_id, m.participant_id, m.text, m.is_answered, m.is_hidden, m.created_at,
+        p.nickname,
+        COUNT(u.id) AS upvote_count
+    FROM qna_messages m
+    LEFT JOIN participants p ON p.id = m.participant_id
+    LEFT JOIN qna_upvotes u ON u.message_id = m.id
+    WHERE m.session_id = %s {where}
+    GROUP BY m.id, p.nickname
+    ORDER BY m.created_at DESC, m.id DESC
+    {limit};
+"""
+QNA_MESSAGES_LIST_FOR_SESSION_SQL = _QNA_MESSAGES_LIST_TEMPLATE.format(where="", limit="LIMIT %s")
+QNA_MESSAGES_LIST_FOR_SESSION_BEFORE_SQL = _QNA_MESSAGES_LIST_TEMPLATE.format(
+    where="AND (m.created_at, m.id) < (%s, %s)", limit="LIMIT %s")
+QNA_MESSAGES_STREAM_FOR_SESSION_SQL = _QNA_MESSAGES_LIST_TEMPLATE.format(where="", limit="")
+
+def qna_messages_list_for_session(conn, session_id: int, before_created_at=None, before_id=None, limit=200):
+    # Newest first, pass the (created_at, id) of the last message you got to get the next page
+    with conn.cursor() as cur:
+        if before_created_at is None or before_id is None:
+            _execute(cur, "qna_messages_list_for_session", QNA_MESSAGES_LIST_FOR_SESSION_SQL, (session_id, limit))
+        else:
+            _execute(cur, "qna_messages_list_for_session_before", QNA_MESSAGES_LIST_FOR_SESSION_BEFORE_SQL,
+                     (session_id, before_created_at, before_id, limit))
+        return [dict(zip(QNA_MESSAGE_COLS, row)) for row in cur.fetchall()]
+
+qna_messages_stream_for_session = _make_stream("qna_messages_stream", QNA_MESSAGES_STREAM_FOR_SESSION_SQL,
+                                               QNA_MESSAGE_COLS)
+
+QNA_MESSAGES_CREATE_SQL = """
+    INSERT INTO qna_messages (session_id, participant_id, text)
+    VALUES (%s, %s, %s)
+    RETURNING id, session_id, participant_id, text, is_answered, is_hidden, created_at;
+"""
+QNA_MESSAGES_CREATE_TYPES = ("bigint", "bigint", "text")
 
 def qna_messages_create(conn, session_id: int, text: str, participant_id=None):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO qna_messages (session_id, participant_id, text)
-                VALUES (%s, %s, %s)
-                RETURNING id, session_id, participant_id, text, is_answered, is_hidden, created_at;
-            """, (session_id, participant_id, text))
-            return cur.fetchone()
+    with _cur(conn) as cur:
+        _execute(cur, "qna_messages_create", QNA_MESSAGES_CREATE_SQL, (session_id, participant_id, text),
+                 types=QNA_MESSAGES_CREATE_TYPES)
+        return cur.fetchone()
+
+qna_messages_get = _make_get("qna_messages")
 
 def qna_messages_patch(conn, message_id: int, is_answered=None, is_hidden=None):
-    updates = []
+    columns = []
     values = []
 
     if is_answered is not None:
-        updates.append("is_answered = %s")
+        columns.append("is_answered")
         values.append(is_answered)
     if is_hidden is not None:
-        updates.append("is_hidden = %s")
+        columns.append("is_hidden")
         values.append(is_hidden)
 
-    if not updates:
+    if not columns:
         return None
 
-    values.append(message_id)
-
-    sql = f"""
-        UPDATE qna_messages
-        SET {", ".join(updates)}
-        WHERE id = %s
-        RETURNING id, session_id, participant_id, text, is_answered, is_hidden, created_at;
-    """
-
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(sql, values)
-            return cur.fetchone()
+    return _patch(conn, "qna_messages", message_id, columns, values, qna_messages_get)
 
-def qna_messages_delete(conn, message_id: int) -> bool:
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("DELETE FROM qna_messages WHERE id = %s RETURNING id;", (message_id,))
-            return cur.fetchone() is not None
+qna_messages_delete = _make_delete("qna_messages")
 
 
 # ============================================
 # Q&A UPVOTES
 # ============================================
 
+QNA_UPVOTES_CREATE_SQL = """
+    INSERT INTO qna_upvotes (message_id, participant_id)
+    VALUES (%s, %s)
+    ON CONFLICT (message_id, participant_id) DO NOTHING
+    RETURNING id, message_id, participant_id, created_at;
+"""
+QNA_UPVOTES_CREATE_TYPES = ("bigint", "bigint")
+
 def qna_upvotes_create(conn, message_id: int, participant_id: int):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                INSERT INTO qna_upvotes (message_id, participant_id)
-                VALUES (%s, %s)
-                RETURNING id, message_id, participant_id, created_at;
-            """, (message_id, participant_id))
-            return cur.fetchone()
+    # Returns None if the participant already upvoted the message
+    with _cur(conn) as cur:
+        _execute(cur, "qna_upvotes_create", QNA_UPVOTES_CREATE_SQL, (message_id, participant_id),
+                 types=QNA_UPVOTES_CREATE_TYPES)
+        return cur.fetchone()
+
+QNA_UPVOTES_BULK_CREATE_SQL = """
+    INSERT INTO qna_upvotes (message_id, participant_id)
+    VALUES %s
+    ON CONFLICT (message_id, participant_id) DO NOTHING
+    RETURNING id, message_id, participant_id, created_at;
+"""
+
+def qna_upvotes_bulk_create(conn, pairs: list[tuple]):
+    # pairs: (message_id, participant_id) tuples, only the new upvotes are returned
+    with _cur(conn) as cur:
+        return execute_values(cur, QNA_UPVOTES_BULK_CREATE_SQL, pairs, page_size=500, fetch=True)
+
+QNA_UPVOTES_DELETE_SQL = """
+    DELETE FROM qna_upvotes
+    WHERE message_id = %s AND participant_id = %s
+    RETURNING id;
+"""
 
 def qna_upvotes_delete(conn, message_id: int, participant_id: int) -> bool:
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                DELETE FROM qna_upvotes
-                WHERE message_id = %s AND participant_id = %s
-                RETURNING id;
-            """, (message_id, participant_id))
-            return cur.fetchone() is not None
+    with _cur(conn) as cur:
+        cur.execute(QNA_UPVOTES_DELETE_SQL, (message_id, participant_id))
+        return cur.fetchone() is not None
@@ -1,28 +1,424 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 
+import asyncpg
+import orjson
 import psycopg2
+from anyio import CancelScope, to_thread
 from dotenv import load_dotenv
+from psycopg2.extensions import connection, make_dsn
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
 load_dotenv(override=True)
 
 DATABASE_NAME = os.getenv("DATABASE_NAME")
+DATABASE_USER = os.getenv("DATABASE_USER", "postgres")
 PASSWORD = os.getenv("PASSWORD")
+# Point these at PgBouncer (usually port 6432) to share a few backends between all workers
+DATABASE_HOST = os.getenv("DATABASE_HOST", "localhost")
+DATABASE_PORT = os.getenv("DATABASE_PORT", "5432")
+# Turn off when running behind PgBouncer in transaction mode, see readme.md
+USE_PREPARED_STATEMENTS = os.getenv("PREPARED_STATEMENTS", "on") != "off"
+# Shows up in pg_stat_activity, so our connections are easy to find when profiling
+APPLICATION_NAME = os.getenv("APPLICATION_NAME", "db-l2-melt")
+
+
+class PreparingConnection(connection):
+    """
+    A normal psycopg2 connection that also remembers which statements
+    have been PREPAREd on it (see db.py), since those live as long as the connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+# Built once at import, every connect() just reuses the string.
+# connect_timeout makes a dead database fail fast instead of hanging a worker
+DSN = make_dsn(
+    dbname=DATABASE_NAME,
+    user=DATABASE_USER,
+    password=PASSWORD,
+    host=DATABASE_HOST,
+    port=DATABASE_PORT,
+    connect_timeout=2,
+    application_name=APPLICATION_NAME,
+)
+
+# Up to POOL_MAX_CONN connections, opened when they are first needed and kept open
+# once returned, together with the statements PREPAREd on them
+POOL_MAX_CONN = 50
+# How long a request waits for a free connection before giving up with PoolError (503, see app.py)
+POOL_TIMEOUT = 5  # seconds
+
+# Created when fastapi starts (see app.py) and shared by every request
+POOL = None
+# Waited on in the event loop, so a request waiting for a connection never holds a worker thread
+_pool_slots = asyncio.Semaphore(POOL_MAX_CONN)
+
+
+class LazyConnectionPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool opens minconn connections up front and closes
+    returned ones once minconn are idle. This one opens nothing up front
+    and keeps every returned connection for the next request
+    """
+
+    def __init__(self, maxconn, *args, **kwargs):
+        super().__init__(0, maxconn, *args, **kwargs)
+        self.minconn = maxconn
 
 
 def get_connection():
     """
     Function that returns a single connection
-    In reality, we might use a connection pool, since
-    this way we'll start a new connection each time
-    someone hits one of our endpoints, which isn't great for performance
+    Borrowed from POOL while the api is running, a brand new one otherwise
+    (e.g when running this file as a script).
+    Always give it back with release_connection
+    """
+    if POOL is not None:
+        return POOL.getconn()
+    return psycopg2.connect(DSN, connection_factory=PreparingConnection)
+
+
+def release_connection(con):
+    if POOL is not None:
+        POOL.putconn(con)
+    else:
+        con.close()
+
+
+def init_pool():
+    """
+    Opens the connection pool, so that a request reuses an already
+    open connection instead of paying for a new one every time
+    """
+    global POOL
+    if POOL is None:
+        POOL = LazyConnectionPool(POOL_MAX_CONN, DSN, connection_factory=PreparingConnection)
+    return POOL
+
+
+def close_pool():
+    global POOL
+    if POOL is not None:
+        POOL.closeall()
+        POOL = None
+
+
+def _rollback(conn):
+    # The connection itself may be what failed, then there is nothing to roll back
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        pass
+
+
+@asynccontextmanager
+async def pooled_connection():
+    """
+    Borrows a connection from POOL for the duration of an async with-block.
+    Waiting for a free one happens in the event loop, connecting, committing
+    and giving it back run in the threadpool (psycopg2 blocks).
+    Everything inside the block is one transaction: committed when the
+    block finishes, rolled back if it raises
+    """
+    try:
+        await asyncio.wait_for(_pool_slots.acquire(), POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolError("no free database connection")
+    try:
+        conn = await to_thread.run_sync(get_connection)
+        # Shielded, so a client that disconnects can't leave the connection half finished or lost
+        try:
+            yield conn
+        except BaseException:
+            with CancelScope(shield=True):
+                await to_thread.run_sync(_rollback, conn)
+            raise
+        else:
+            with CancelScope(shield=True):
+                await to_thread.run_sync(conn.commit)
+        finally:
+            with CancelScope(shield=True):
+                await to_thread.run_sync(release_connection, conn)
+    finally:
+        _pool_slots.release()
+
+
+async def get_db():
     """
-    return psycopg2.connect(
-        dbname=DATABASE_NAME,
-        user="postgres",  # change if needed
-        password=PASSWORD,
-        host="localhost",  # change if needed
-        port="5432",  # change if needed
-    )
+    FastAPI dependency, lends one pooled connection to a request.
+    The whole request runs in a single transaction. Use it as
+    Depends(get_db, scope="function"): the commit then happens before the
+    response is sent, so a failed commit is a 500 and not a false success
+    """
+    async with pooled_connection() as conn:
+        yield conn
+
+
+# asyncpg pool for "async def" endpoints, next to the psycopg2 one above
+ASYNC_POOL = None
+_async_pool_lock = asyncio.Lock()
+
+
+async def _init_async_connection(conn):
+    # json/jsonb columns come back as dicts and take dicts as parameters, using orjson
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(type_name, schema="pg_catalog", format="text",
+                                  encoder=lambda value: orjson.dumps(value).decode(), decoder=orjson.loads)
+
+
+async def get_pool():
+    """
+    Returns the asyncpg pool, creating it the first time it's needed.
+    asyncpg prepares and caches every query per connection by itself
+    """
+    global ASYNC_POOL
+    async with _async_pool_lock:
+        if ASYNC_POOL is None:
+            ASYNC_POOL = await asyncpg.create_pool(
+                database=DATABASE_NAME,
+                user=DATABASE_USER,
+                password=PASSWORD,
+                host=DATABASE_HOST,
+                port=DATABASE_PORT,
+                timeout=2,
+                min_size=2,
+                max_size=20,
+                statement_cache_size=1024 if USE_PREPARED_STATEMENTS else 0,
+                init=_init_async_connection,
+                server_settings={"application_name": APPLICATION_NAME},
+            )
+    return ASYNC_POOL
+
+
+async def close_async_pool():
+    global ASYNC_POOL
+    if ASYNC_POOL is not None:
+        await ASYNC_POOL.close()
+        ASYNC_POOL = None
+
+
+async def get_async_db():
+    """
+    Same as get_db, but lends an asyncpg connection to an async endpoint
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        yield conn
+
+
+SCHEMA_SQL = """
+    -- ----------------------------
+    -- TYPES: enums are stored as 4 bytes and Postgres rejects anything else
+    -- ----------------------------
+    CREATE TYPE user_role AS ENUM ('teacher', 'student', 'admin');
+    CREATE TYPE session_status AS ENUM ('created', 'live', 'ended');
+    CREATE DOMAIN session_code AS VARCHAR(12)
+        CHECK (VALUE ~ '^[0-9A-Za-z]{4,12}$');
+
+    -- ----------------------------
+    -- USERS
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS users (
+        id            SERIAL PRIMARY KEY,
+        email         VARCHAR(255) NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        avatar_url    TEXT NULL,
+        role          user_role NOT NULL DEFAULT 'teacher',
+        created_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at    TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    -- ----------------------------
+    -- PRESENTATIONS
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS presentations (
+        id         SERIAL PRIMARY KEY,
+        owner_id   BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        title      VARCHAR(255) NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    -- ----------------------------
+    -- QUESTION TYPES (lookup)
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS question_types (
+        code               VARCHAR(50) PRIMARY KEY,
+        label              VARCHAR(100) NOT NULL,
+        uses_options        BOOLEAN NOT NULL DEFAULT FALSE,
+        allows_text_answer  BOOLEAN NOT NULL DEFAULT FALSE
+    );
+
+    -- Seeded from QUESTION_TYPES below
+
+    -- ----------------------------
+    -- QUESTIONS
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS questions (
+        id              SERIAL PRIMARY KEY,
+        presentation_id INT NOT NULL REFERENCES presentations(id) ON DELETE CASCADE,
+        type_code       VARCHAR(50) NOT NULL REFERENCES question_types(code),
+        text            TEXT NOT NULL,
+        media_url       TEXT NULL,
+        order_index     INTEGER NOT NULL DEFAULT 0,
+        settings        JSONB NOT NULL DEFAULT '{}'::jsonb,
+        created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    -- ----------------------------
+    -- OPTIONS
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS options (
+        id          SERIAL PRIMARY KEY,
+        question_id INT NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+        text        TEXT NOT NULL,
+        is_correct  BOOLEAN NOT NULL DEFAULT FALSE,
+        order_index INT NOT NULL DEFAULT 0
+    );
+
+    -- ----------------------------
+    -- LIVE SESSIONS
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS live_sessions (
+        id                  BIGSERIAL PRIMARY KEY,
+        presentation_id     BIGINT NOT NULL REFERENCES presentations(id) ON DELETE CASCADE,
+        access_code         session_code NOT NULL UNIQUE,
+        status              session_status NOT NULL DEFAULT 'created',
+        current_question_id INT NULL REFERENCES questions(id) ON DELETE SET NULL,
+        created_at          TIMESTAMPTZ NOT NULL DEFAULT now(),
+        started_at          TIMESTAMPTZ NULL,
+        ended_at            TIMESTAMPTZ NULL
+    );
+
+    -- ----------------------------
+    -- PARTICIPANTS
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS participants (
+        id         BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        session_id BIGINT NOT NULL REFERENCES live_sessions(id) ON DELETE CASCADE,
+        nickname   VARCHAR(60) NOT NULL,
+        joined_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+        UNIQUE (session_id, nickname)
+    );
+
+    -- ----------------------------
+    -- VOTES (hash partitioned on session_id, partitions in VOTES_PARTITIONS_SQL)
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS votes (
+        id             BIGSERIAL,
+        session_id     BIGINT NOT NULL REFERENCES live_sessions(id) ON DELETE CASCADE,
+        participant_id BIGINT NOT NULL REFERENCES participants(id) ON DELETE CASCADE,
+        question_id    INT NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+        option_id      INT NULL REFERENCES options(id) ON DELETE SET NULL,
+        text_answer    TEXT NULL,
+        created_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+        CONSTRAINT votes_one_answer_only CHECK (
+            (option_id IS NOT NULL) <> (text_answer IS NOT NULL)
+        ),
+        PRIMARY KEY (session_id, id),
+        CONSTRAINT votes_one_per_question UNIQUE (session_id, participant_id, question_id)
+    ) PARTITION BY HASH (session_id);
+
+    -- ----------------------------
+    -- Q&A MESSAGES
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS qna_messages (
+        id             BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        session_id     BIGINT NOT NULL REFERENCES live_sessions(id) ON DELETE CASCADE,
+        participant_id BIGINT NULL REFERENCES participants(id) ON DELETE SET NULL,
+        text           TEXT NOT NULL,
+        is_answered    BOOLEAN NOT NULL DEFAULT FALSE,
+        is_hidden      BOOLEAN NOT NULL DEFAULT FALSE,
+        created_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    -- ----------------------------
+    -- Q&A UPVOTES (bridge)
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS qna_upvotes (
+        id             BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        message_id     BIGINT NOT NULL REFERENCES qna_messages(id) ON DELETE CASCADE,
+        participant_id BIGINT NOT NULL REFERENCES participants(id) ON DELETE CASCADE,
+        created_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
+        UNIQUE (message_id, participant_id)
+    );
+"""
+
+# Everything here can run again on an existing database, and brings it up to date
+SCHEMA_UPDATE_SQL = """
+    -- ----------------------------
+    -- Indexes (performance)
+    -- ----------------------------
+    CREATE INDEX IF NOT EXISTS idx_questions_presentation_order ON questions(presentation_id, order_index);
+    CREATE INDEX IF NOT EXISTS idx_options_question ON options(question_id);
+    CREATE INDEX IF NOT EXISTS idx_sessions_presentation ON live_sessions(presentation_id);
+    CREATE INDEX IF NOT EXISTS idx_participants_session ON participants(session_id);
+    CREATE INDEX IF NOT EXISTS idx_votes_session_question ON votes(session_id, question_id);
+    -- text_answer is left out on purpose: a long answer would exceed the btree row size limit
+    CREATE INDEX IF NOT EXISTS idx_votes_session_created ON votes(session_id, created_at, id)
+        INCLUDE (participant_id, question_id, option_id);
+    -- Option tallies: count(*) ... GROUP BY option_id is an index-only scan.
+    -- Text answers never have an option_id, so they are left out of the index
+    CREATE INDEX IF NOT EXISTS idx_votes_session_question_option ON votes(session_id, question_id, option_id)
+        WHERE option_id IS NOT NULL;
+    CREATE STATISTICS IF NOT EXISTS votes_question_option_stats (ndistinct, dependencies)
+        ON question_id, option_id FROM votes;
+    CREATE INDEX IF NOT EXISTS idx_qna_messages_session ON qna_messages(session_id, created_at DESC, id DESC);
+    -- qna_upvotes needs no index on message_id, UNIQUE (message_id, participant_id) starts with it
+
+    -- ----------------------------
+    -- Live votes: every new vote is sent on channel vote_<session_id> (see live.py).
+    -- The id keeps payloads unique, Postgres drops identical notifications in a transaction
+    -- ----------------------------
+    CREATE OR REPLACE FUNCTION votes_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('vote_' || NEW.session_id,
+            json_build_object('id', NEW.id, 'question_id', NEW.question_id, 'option_id', NEW.option_id)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER votes_notify AFTER INSERT ON votes
+        FOR EACH ROW EXECUTE FUNCTION votes_notify();
+"""
+
+# A session's votes all land in one partition, so its queries only touch that one
+VOTE_PARTITIONS = 16
+VOTES_PARTITIONS_SQL = "".join(
+    f"CREATE TABLE IF NOT EXISTS votes_p{i} PARTITION OF votes FOR VALUES WITH (MODULUS {VOTE_PARTITIONS}, REMAINDER {i});\n"
+    for i in range(VOTE_PARTITIONS)
+)
+
+# Seed for question_types: (code, label, uses_options, allows_text_answer)
+QUESTION_TYPES = [
+    ("multiple_choice", "Multiple choice", True, False),
+    ("quiz", "Quiz", True, False),
+    ("open_ended", "Open ended", False, True),
+    ("word_cloud", "Word cloud", False, True),
+    ("scales", "Scales", False, False),
+    ("ranking", "Ranking", False, False),
+    ("qna", "Q&A", False, True),
+    ("image_choice", "Image choice", True, False),
+    ("slider", "Slider", False, False),
+    ("grid", "Grid", False, False),
+    ("prioritization", "Prioritization", False, False),
+    ("quick_form", "Quick form", False, True),
+    ("content_slide", "Content slide", False, False),
+]
+
+QUESTION_TYPES_SEED_SQL = """
+    INSERT INTO question_types (code, label, uses_options, allows_text_answer)
+    VALUES %s
+    ON CONFLICT (code) DO NOTHING;
+"""
 
 
 def create_tables():
@@ -30,186 +426,18 @@ def create_tables():
     cur = con.cursor()
 
     try:
-        # ----------------------------
-        # USERS
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE users (
-            id            SERIAL PRIMARY KEY,
-            email         VARCHAR(255) NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            avatar_url    TEXT NULL,
-            role          VARCHAR(30) NOT NULL DEFAULT 'teacher',
-            created_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
-            updated_at    TIMESTAMPTZ NOT NULL DEFAULT now()
-        );
-        """)
-
-        # ----------------------------
-        # PRESENTATIONS
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE presentations (
-            id         SERIAL PRIMARY KEY,
-            owner_id   BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            title      VARCHAR(255) NOT NULL,
-            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
-        );
-        """)
-
-        # ----------------------------
-        # QUESTION TYPES (lookup)
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE question_types (
-            code               VARCHAR(50) PRIMARY KEY,
-            label              VARCHAR(100) NOT NULL,
-            uses_options        BOOLEAN NOT NULL DEFAULT FALSE,
-            allows_text_answer  BOOLEAN NOT NULL DEFAULT FALSE
-        );
-        """)
-
-        # Seed 
-        cur.execute("""
-        INSERT INTO question_types (code, label, uses_options, allows_text_answer) VALUES
-        ('multiple_choice','Multiple choice', TRUE,  FALSE),
-        ('quiz','Quiz', TRUE, FALSE),
-        ('open_ended','Open ended', FALSE, TRUE),
-        ('word_cloud','Word cloud', FALSE, TRUE),
-        ('scales','Scales', FALSE, FALSE),
-        ('ranking','Ranking', FALSE, FALSE),
-        ('qna','Q&A', FALSE, TRUE),
-        ('image_choice','Image choice', TRUE, FALSE),
-        ('slider','Slider', FALSE, FALSE),
-        ('grid','Grid', FALSE, FALSE),
-        ('prioritization','Prioritization', FALSE, FALSE),
-        ('quick_form','Quick form', FALSE, TRUE),
-        ('content_slide','Content slide', FALSE, FALSE)
-        ON CONFLICT (code) DO NOTHING;
-        """)
-
-        # ----------------------------
-        # QUESTIONS
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE questions (
-            id              SERIAL PRIMARY KEY,
-            presentation_id INT NOT NULL REFERENCES presentations(id) ON DELETE CASCADE,
-            type_code       VARCHAR(50) NOT NULL REFERENCES question_types(code),
-            text            TEXT NOT NULL,
-            media_url       TEXT NULL,
-            order_index     INTEGER NOT NULL DEFAULT 0,
-            settings        JSONB NOT NULL DEFAULT '{}'::jsonb,
-            created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
-            updated_at      TIMESTAMPTZ NOT NULL DEFAULT now()
-        );
-        """)
-
-        # ----------------------------
-        # OPTIONS
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE options (
-            id          SERIAL PRIMARY KEY,
-            question_id INT NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
-            text        TEXT NOT NULL,
-            is_correct  BOOLEAN NOT NULL DEFAULT FALSE,
-            order_index INT NOT NULL DEFAULT 0
-        );
-        """)
-
-        # ----------------------------
-        # LIVE SESSIONS
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE live_sessions (
-            id                  BIGSERIAL PRIMARY KEY,
-            presentation_id     BIGINT NOT NULL REFERENCES presentations(id) ON DELETE CASCADE,
-            access_code         VARCHAR(12) NOT NULL UNIQUE,
-            status              VARCHAR(20) NOT NULL DEFAULT 'created',
-            current_question_id INT NULL REFERENCES questions(id) ON DELETE SET NULL,
-            created_at          TIMESTAMPTZ NOT NULL DEFAULT now(),
-            started_at          TIMESTAMPTZ NULL,
-            ended_at            TIMESTAMPTZ NULL,
-            CONSTRAINT live_sessions_status_check CHECK (status IN ('created','live','ended'))
-        );
-        """)
-
-        # ----------------------------
-        # PARTICIPANTS
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE participants (
-            id         SERIAL PRIMARY KEY,
-            session_id INT NOT NULL REFERENCES live_sessions(id) ON DELETE CASCADE,
-            nickname   VARCHAR(60) NOT NULL,
-            joined_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
-            UNIQUE (session_id, nickname)
-        );
-        """)
-
-        # ----------------------------
-        # VOTES
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE votes (
-            id             SERIAL PRIMARY KEY,
-            session_id     INT NOT NULL REFERENCES live_sessions(id) ON DELETE CASCADE,
-            participant_id INT NOT NULL REFERENCES participants(id) ON DELETE CASCADE,
-            question_id    INT NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
-            option_id      INT NULL REFERENCES options(id) ON DELETE SET NULL,
-            text_answer    TEXT NULL,
-            created_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
-
-            CONSTRAINT votes_one_answer_only CHECK (
-                (option_id IS NOT NULL) <> (text_answer IS NOT NULL)
-            ),
-            CONSTRAINT votes_one_per_question UNIQUE (session_id, participant_id, question_id)
-        );
-        """)
-
-        # ----------------------------
-        # Q&A MESSAGES
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE qna_messages (
-            id             SERIAL PRIMARY KEY,
-            session_id     INT NOT NULL REFERENCES live_sessions(id) ON DELETE CASCADE,
-            participant_id INT NULL REFERENCES participants(id) ON DELETE SET NULL,
-            text           TEXT NOT NULL,
-            is_answered    BOOLEAN NOT NULL DEFAULT FALSE,
-            is_hidden      BOOLEAN NOT NULL DEFAULT FALSE,
-            created_at     TIMESTAMPTZ NOT NULL DEFAULT now()
-        );
-        """)
-
-        # ----------------------------
-        # Q&A UPVOTES (bridge)
-        # ----------------------------
-        cur.execute("""
-        CREATE TABLE qna_upvotes (
-            id             SERIAL PRIMARY KEY,
-            message_id     INT NOT NULL REFERENCES qna_messages(id) ON DELETE CASCADE,
-            participant_id INT NOT NULL REFERENCES participants(id) ON DELETE CASCADE,
-            created_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
-            UNIQUE (message_id, participant_id)
-        );
-        """)
-
-        # ----------------------------
-        # Indexes (performance)
-        # ----------------------------
-        cur.execute("CREATE INDEX idx_questions_presentation_order ON questions(presentation_id, order_index);")
-        cur.execute("CREATE INDEX idx_options_question ON options(question_id);")
-        cur.execute("CREATE INDEX idx_sessions_presentation ON live_sessions(presentation_id);")
-        cur.execute("CREATE INDEX idx_participants_session ON participants(session_id);")
-        cur.execute("CREATE INDEX idx_votes_session_question ON votes(session_id, question_id);")
-        cur.execute("CREATE INDEX idx_qna_messages_session ON qna_messages(session_id, created_at);")
-        cur.execute("CREATE INDEX idx_qna_upvotes_message ON qna_upvotes(message_id);")
+        # Types and tables are only created once (CREATE TYPE has no IF NOT EXISTS)
+        cur.execute("SELECT to_regclass('public.users');")
+        created = cur.fetchone()[0] is None
+        # The schema goes to Postgres as one script, in one round trip
+        if created:
+            cur.execute(SCHEMA_SQL + VOTES_PARTITIONS_SQL + SCHEMA_UPDATE_SQL)
+        else:
+            cur.execute(SCHEMA_UPDATE_SQL)
+        execute_values(cur, QUESTION_TYPES_SEED_SQL, QUESTION_TYPES, page_size=1000)
 
         con.commit()
-        print(" Tables created successfully.")
+        print(" Tables created successfully." if created else " Tables already exist, indexes and triggers updated.")
 
     except Exception as e:
         con.rollback()
@@ -218,9 +446,8 @@ def create_tables():
 
     finally:
         cur.close()
-        con.close()
+        release_connection(con)
 
 if __name__ == "__main__":
     # Only reason to execute this file would be to create new tables, meaning it serves a migration file
-    create_tables()
-    print("Tables created successfully.")
\ No newline at end of file
+    create_tables()
\ No newline at end of file
@@ -0,0 +1,124 @@
+import asyncio
+import os
+
+import asyncpg
+from db_setup import APPLICATION_NAME, DATABASE_HOST, DATABASE_NAME, DATABASE_PORT, DATABASE_USER, PASSWORD
+
+"""
+LIVE VOTES
+----------
+The votes_notify trigger (db_setup.py) sends every new vote on the channel
+vote_<session_id>. One asyncpg connection LISTENs on the channels of the
+sessions someone is watching and hands each notification to the queues of
+that session's websockets, so dashboards never have to poll the votes table.
+"""
+
+# LISTEN needs a real session, PgBouncer in transaction mode can't forward it.
+# Point these straight at Postgres when DATABASE_HOST/PORT is PgBouncer
+LISTEN_HOST = os.getenv("LISTEN_DATABASE_HOST", DATABASE_HOST)
+LISTEN_PORT = os.getenv("LISTEN_DATABASE_PORT", DATABASE_PORT)
+
+# Votes a websocket may fall behind by before it is closed (it gets None, see _on_vote)
+SUBSCRIBER_QUEUE_MAX = 1000
+LISTENER_RETRY_MAX_DELAY = 5  # seconds
+
+_listener = None
+_listener_lock = asyncio.Lock()
+_reconnect_task = None
+_closing = False
+# session_id -> queues of the websockets watching it
+_subscribers: dict[int, set[asyncio.Queue]] = {}
+
+
+def _channel(session_id: int):
+    return f"vote_{session_id}"
+
+
+def _on_vote(conn, pid, channel, payload):
+    session_id = int(channel.removeprefix("vote_"))
+    queues = _subscribers.get(session_id, set())
+    for queue in list(queues):
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # A client that stopped reading: drop what it hasn't read and tell it to go away
+            queues.discard(queue)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+def _on_listener_lost(conn):
+    # The LISTEN connection is gone (database restart, network), so are all its LISTENs
+    global _reconnect_task
+    if not _closing and (_reconnect_task is None or _reconnect_task.done()):
+        _reconnect_task = asyncio.create_task(_reconnect())
+
+
+async def _reconnect():
+    delay = 0.1
+    while not _closing:
+        try:
+            async with _listener_lock:
+                listener = await _get_listener()
+                for session_id in _subscribers:
+                    await listener.add_listener(_channel(session_id), _on_vote)
+            return
+        except Exception as e:
+            print(" Error reconnecting vote listener, retrying:", e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LISTENER_RETRY_MAX_DELAY)
+
+
+async def _get_listener():
+    global _listener
+    if _listener is None or _listener.is_closed():
+        _listener = await asyncpg.connect(
+            database=DATABASE_NAME,
+            user=DATABASE_USER,
+            password=PASSWORD,
+            host=LISTEN_HOST,
+            port=LISTEN_PORT,
+            timeout=2,
+            server_settings={"application_name": f"{APPLICATION_NAME}-listener"},
+        )
+        _listener.add_termination_listener(_on_listener_lost)
+    return _listener
+
+
+async def subscribe_votes(session_id: int):
+    """
+    Returns a queue that gets the JSON payload of every new vote in the session,
+    or None when the subscriber fell more than SUBSCRIBER_QUEUE_MAX votes behind.
+    The channel is only LISTENed on while at least one queue is subscribed
+    """
+    queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_MAX)
+    async with _listener_lock:
+        if session_id not in _subscribers:
+            listener = await _get_listener()
+            await listener.add_listener(_channel(session_id), _on_vote)
+            _subscribers[session_id] = set()
+        _subscribers[session_id].add(queue)
+    return queue
+
+
+async def unsubscribe_votes(session_id: int, queue: asyncio.Queue):
+    async with _listener_lock:
+        queues = _subscribers.get(session_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del _subscribers[session_id]
+            if _listener is not None and not _listener.is_closed():
+                await _listener.remove_listener(_channel(session_id), _on_vote)
+
+
+async def close_listener():
+    global _listener, _closing
+    _closing = True
+    if _reconnect_task is not None:
+        _reconnect_task.cancel()
+    if _listener is not None:
+        await _listener.close()
+        _listener = None
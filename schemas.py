@@ -1,89 +1,115 @@
 # Add Pydantic schemas here that you'll use in your routes / endpoints
 # Pydantic schemas are used to validate data that you receive, or to make sure that whatever data
 # you send back to the client follows a certain structure
-from typing import Optional
+from dataclasses import dataclass
+from typing import Annotated, Optional
 
-from pydantic import BaseModel
+import msgspec
+from pydantic import BaseModel, ConfigDict, Field
+
+# Base for all models: request bodies are only read, never changed, so they are frozen
+# (immutable and hashable). Pydantic has no slots option, the hot ones below are dataclasses
+class Schema(BaseModel):
+    model_config = ConfigDict(frozen=True)
 
 # Dessa måste finnas för att app.py inte ska krascha
 # Tänk på dem som "formulär" som FastAPI använder.
 
-class UserCreate(BaseModel):
+class UserCreate(Schema):
     email: str
     password_hash: str
     avatar_url: Optional[str] = None
-    role: str = "user"
+    # One of teacher/student/admin, the user_role enum in the database rejects anything else
+    role: str = "teacher"
 
-class UserUpdate(BaseModel):
+class UserUpdate(Schema):
     email: str
     password_hash: str
     avatar_url: Optional[str] = None
     role: str
 
-class UserPatch(BaseModel):
+class UserPatch(Schema):
     email: Optional[str] = None
     password_hash: Optional[str] = None
     avatar_url: Optional[str] = None
     role: Optional[str] = None
 
-class PresentationCreate(BaseModel):
+class PresentationCreate(Schema):
     title: str
     owner_id: int
 
-class PresentationUpdate(BaseModel):
+class PresentationUpdate(Schema):
     title: str
 
-class QuestionCreate(BaseModel):
+class QuestionSettings(Schema):
+    # The common settings are typed, type specific ones (e.g slider min/max) are kept as extra fields.
+    # The db.py question functions take it as it is
+    model_config = ConfigDict(extra="allow")
+
+    duration_s: int = 30
+    show_results: bool = True
+
+class QuestionCreate(Schema):
     type_code: str
     text: str
     media_url: Optional[str] = None
     order_index: int = 0
-    settings: Optional[dict] = {}
+    settings: QuestionSettings = Field(default_factory=QuestionSettings)
 
-class QuestionUpdate(BaseModel):
+class QuestionUpdate(Schema):
     type_code: str
     text: str
     media_url: Optional[str] = None
     order_index: int
-    settings: Optional[dict] = {}
+    settings: QuestionSettings = Field(default_factory=QuestionSettings)
 
-class OptionCreate(BaseModel):
+class OptionCreate(Schema):
     text: str
     is_correct: bool = False
     order_index: int = 0
 
-class OptionUpdate(BaseModel):
+class OptionUpdate(Schema):
     text: str
     is_correct: bool
     order_index: int
 
-class LiveSessionCreate(BaseModel):
+class LiveSessionCreate(Schema):
     access_code: str
 
-class LiveSessionUpdate(BaseModel):
+class LiveSessionUpdate(Schema):
     status: str
     current_question_id: Optional[int] = None
 
-class LiveSessionPatch(BaseModel):
+class LiveSessionPatch(Schema):
     status: Optional[str] = None
     current_question_id: Optional[int] = None
 
-class ParticipantCreate(BaseModel):
+# Sent by every participant, many times per session: plain slotted dataclasses,
+# which pydantic v2 validates directly without building a model instance
+@dataclass(slots=True, frozen=True)
+class ParticipantCreate:
     nickname: str
 
-class VoteCreate(BaseModel):
-    participant_id: int
-    question_id: int
-    option_id: Optional[int] = None
-    text_answer: Optional[str] = None
+# Ids that fit their INT / BIGINT columns, anything else is rejected before it reaches a batch
+Int4Id = Annotated[int, msgspec.Meta(ge=1, le=2**31 - 1)]
+Int8Id = Annotated[int, msgspec.Meta(ge=1, le=2**63 - 1)]
+# Postgres text can't hold NUL characters
+Text = Annotated[str, msgspec.Meta(pattern="^[^\x00]*$")]
+
+# Votes skip pydantic: msgspec decodes the request bytes straight into this struct (see app.py)
+class VoteCreate(msgspec.Struct, frozen=True):
+    participant_id: Int8Id
+    question_id: Int4Id
+    option_id: Optional[Int4Id] = None
+    text_answer: Optional[Text] = None
 
-class QnAMessageCreate(BaseModel):
+class QnAMessageCreate(Schema):
     text: str
     participant_id: int
 
-class QnAMessageUpdate(BaseModel):
+class QnAMessageUpdate(Schema):
     is_answered: bool
     is_hidden: bool
 
-class UpvoteCreate(BaseModel):
+class UpvoteCreate(Schema):
     participant_id: int
\ No newline at end of file
@@ -0,0 +1,128 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import app
+import psycopg2
+import pytest
+from psycopg2.errors import ForeignKeyViolation, ProgramLimitExceeded, UniqueViolation
+
+"""
+Checks how flush_votes and vote_writer handle failing writes, without a
+database: votes_copy and votes_bulk_create are replaced by fakes that record
+what they were asked to write, or raise.
+"""
+
+
+class FakeConnection:
+    # Stands in for "with con:" (one transaction per block)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def written(monkeypatch):
+    # Every vote a fake write accepted, as (session_id, participant_id, question_id, option_id, text_answer)
+    written = []
+    monkeypatch.setattr(app, "votes_copy", lambda con, votes: written.extend(votes))
+    monkeypatch.setattr(app, "votes_bulk_create",
+                        lambda con, session_id, votes: written.extend((session_id, *vote) for vote in votes))
+    return written
+
+
+def test_duplicates_in_batch_first_wins(written):
+    app.flush_votes(FakeConnection(), [(1, 10, 100, 1, None), (1, 10, 100, 2, None), (1, 11, 100, 2, None)])
+    assert written == [(1, 10, 100, 1, None), (1, 11, 100, 2, None)]
+
+
+def test_copy_conflict_falls_back_to_insert(monkeypatch, written):
+    def copy(con, votes):
+        raise UniqueViolation("duplicate key")
+
+    monkeypatch.setattr(app, "votes_copy", copy)
+    app.flush_votes(FakeConnection(), [(1, 10, 100, 1, None), (2, 10, 200, None, "hej")])
+    assert written == [(1, 10, 100, 1, None), (2, 10, 200, None, "hej")]
+
+
+def test_bad_votes_are_dropped_one_by_one(monkeypatch, written):
+    def copy(con, votes):
+        raise ForeignKeyViolation("no such participant")
+
+    def bulk_create(con, session_id, votes):
+        if any(vote[0] == 99 for vote in votes):
+            raise ForeignKeyViolation("no such participant")
+        written.extend((session_id, *vote) for vote in votes)
+
+    monkeypatch.setattr(app, "votes_copy", copy)
+    monkeypatch.setattr(app, "votes_bulk_create", bulk_create)
+    app.flush_votes(FakeConnection(), [(1, 10, 100, 1, None), (1, 99, 100, 1, None), (1, 11, 100, 2, None)])
+    assert written == [(1, 10, 100, 1, None), (1, 11, 100, 2, None)]
+
+
+def test_data_errors_are_not_retried(monkeypatch, written):
+    # An OperationalError subclass, but about a vote, not about the connection
+    def bulk_create(con, session_id, votes):
+        raise ProgramLimitExceeded("index row size exceeds maximum")
+
+    monkeypatch.setattr(app, "votes_bulk_create", bulk_create)
+    app.flush_votes(FakeConnection(), [(1, 10, 100, None, "x" * 10_000)], row_by_row=True)
+    assert written == []
+
+
+def test_lost_connection_is_raised(monkeypatch, written):
+    def copy(con, votes):
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    monkeypatch.setattr(app, "votes_copy", copy)
+    with pytest.raises(psycopg2.OperationalError):
+        app.flush_votes(FakeConnection(), [(1, 10, 100, 1, None)])
+    assert written == []
+
+
+def run_vote_writer(monkeypatch, flush_votes, votes):
+    # Queues the votes and runs vote_writer until all of them are marked done
+    @asynccontextmanager
+    async def pooled_connection():
+        yield FakeConnection()
+
+    monkeypatch.setattr(app, "pooled_connection", pooled_connection)
+    monkeypatch.setattr(app, "flush_votes", flush_votes)
+    monkeypatch.setattr(app, "VOTE_RETRY_MAX_DELAY", 0)
+
+    async def main():
+        monkeypatch.setattr(app, "vote_queue", asyncio.Queue())
+        for vote in votes:
+            app.vote_queue.put_nowait(vote)
+        writer = asyncio.create_task(app.vote_writer())
+        try:
+            await asyncio.wait_for(app.vote_queue.join(), 5)
+        finally:
+            writer.cancel()
+
+    asyncio.run(main())
+
+
+def test_writer_retries_transient_errors(monkeypatch):
+    calls = []
+
+    def flush_votes(con, votes, row_by_row=False):
+        calls.append(row_by_row)
+        if len(calls) < 3:
+            raise psycopg2.OperationalError("could not connect to server")
+
+    run_vote_writer(monkeypatch, flush_votes, [(1, 10, 100, 1, None)])
+    assert calls == [False, False, False]
+
+
+def test_writer_goes_row_by_row_after_retries(monkeypatch):
+    calls = []
+
+    def flush_votes(con, votes, row_by_row=False):
+        calls.append(row_by_row)
+        if not row_by_row:
+            raise psycopg2.OperationalError("could not connect to server")
+
+    run_vote_writer(monkeypatch, flush_votes, [(1, 10, 100, 1, None)])
+    assert calls == [False] * app.VOTE_RETRY_ATTEMPTS + [True]
@@ -0,0 +1,59 @@
+import struct
+
+import pytest
+from db import _votes_copy_data
+
+"""
+Checks the binary COPY stream that votes_copy sends, by reading it back the
+way Postgres does: header, one tuple per vote (field count, then each field
+as a length and its bytes, -1 for NULL) and the -1 trailer.
+"""
+
+
+def read_copy_data(data):
+    assert data[:11] == b"PGCOPY\n\xff\r\n\x00"
+    assert struct.unpack("!ii", data[11:19]) == (0, 0)
+    pos = 19
+    rows = []
+    while True:
+        (count,) = struct.unpack_from("!h", data, pos)
+        pos += 2
+        if count == -1:
+            break
+        fields = []
+        for _ in range(count):
+            (length,) = struct.unpack_from("!i", data, pos)
+            pos += 4
+            if length == -1:
+                fields.append(None)
+            else:
+                fields.append(data[pos:pos + length])
+                pos += length
+        rows.append(fields)
+    assert pos == len(data)
+    return rows
+
+
+def test_empty():
+    assert read_copy_data(_votes_copy_data([])) == []
+
+
+def test_option_and_text_votes():
+    rows = read_copy_data(_votes_copy_data([
+        (1, 2**40, 3, 4, None),
+        (5, 6, 7, None, "hej, åäö"),
+    ]))
+    assert rows == [
+        [struct.pack("!q", 1), struct.pack("!q", 2**40), struct.pack("!i", 3), struct.pack("!i", 4), None],
+        [struct.pack("!q", 5), struct.pack("!q", 6), struct.pack("!i", 7), None, "hej, åäö".encode()],
+    ]
+
+
+def test_empty_text_is_not_null():
+    rows = read_copy_data(_votes_copy_data([(1, 1, 1, None, "")]))
+    assert rows[0][4] == b""
+
+
+def test_id_too_big_for_int4():
+    with pytest.raises(struct.error):
+        _votes_copy_data([(1, 1, 2**31, None, "x")])